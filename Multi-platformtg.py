@@ -10,14 +10,23 @@ from telegram.ext import (
 import yt_dlp
 import os
 import asyncio
-from collections import defaultdict, deque
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict, OrderedDict
 from datetime import datetime, timedelta
 import time
+import math
 from dotenv import load_dotenv
 import logging
-import json
+import orjson
 import shutil
+import uuid
+import atexit
 import re
+import heapq
+from operator import itemgetter
+from functools import lru_cache
+from urllib.parse import urlsplit
 
 # Load environment variables from .env file
 load_dotenv()
@@ -41,12 +50,24 @@ if not TOKEN:
 ADMIN_IDS = [int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()]
 RATE_LIMIT_REQUESTS = 3
 RATE_LIMIT_WINDOW = 300
+RATE_LIMIT_MAX_USERS = 50000  # Least recently seen users beyond this are forgotten
 MAX_CONCURRENT_DOWNLOADS = 2
+MAX_QUEUE_SIZE = MAX_CONCURRENT_DOWNLOADS * 20  # Pending jobs before new links are turned away
+DAILY_STATS_RETENTION_DAYS = 90
 MAX_FILE_SIZE = 100 * 1024 * 1024  # Increased to 100MB for better private video support
 MAX_VIDEO_DURATION = 900  # Increased to 15 minutes
+UPLOAD_TIMEOUT = 120  # Seconds allowed for sending a video of up to MAX_FILE_SIZE
+# Display units for the limits above, used in user-facing messages
+RATE_LIMIT_WINDOW_MIN = RATE_LIMIT_WINDOW // 60
+MAX_FILE_SIZE_MB = MAX_FILE_SIZE // 1024 // 1024
+MAX_VIDEO_DURATION_MIN = MAX_VIDEO_DURATION // 60
+FILE_ID_CACHE_SIZE = 1024  # Sent videos remembered per URL for instant re-sends
+FILE_ID_CACHE_PATH = 'file_id_cache.json'
 
 # Cookie file path for private video access (TikTok only)
 TIKTOK_COOKIES = os.getenv('TIKTOK_COOKIES_PATH', 'cookies/tiktok.txt')
+COOKIE_PATHS = {'TikTok': TIKTOK_COOKIES}
+COOKIE_REFRESH_INTERVAL = 300
 
 # === Analytics Storage ===
 analytics = {
@@ -56,81 +77,272 @@ analytics = {
     'user_stats': defaultdict(int),
     'error_stats': defaultdict(int),
     'private_downloads': defaultdict(int),
+    # Running totals so handlers don't rescan the per-user/per-platform dicts
+    'active_user_count': 0,
+    'private_total': 0,
+    # Users with a download on active_today_date; reset when the day rolls over
+    'active_today': set(),
+    'active_today_date': '',
     'start_time': datetime.now()
 }
 
+def write_file_atomic(path, data):
+    """Write bytes to a temp file and swap it in, so readers never see a torn file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+# Per-key counters that must stay defaultdict(int) after loading from disk
+ANALYTICS_COUNTERS = ('daily_downloads', 'platform_stats', 'user_stats', 'error_stats', 'private_downloads')
+
 # Load existing analytics
 def load_analytics():
     try:
         if os.path.exists('analytics.json'):
-            with open('analytics.json', 'r') as f:
-                data = json.load(f)
-                analytics.update(data)
-                analytics['start_time'] = datetime.fromisoformat(analytics.get('start_time', datetime.now().isoformat()))
+            with open('analytics.json', 'rb') as f:
+                data = orjson.loads(f.read())
+            for key in ANALYTICS_COUNTERS:
+                counts = data.get(key, {})
+                if key == 'user_stats':
+                    # JSON object keys are strings, but user IDs are ints everywhere else
+                    counts = {int(k): v for k, v in counts.items()}
+                analytics[key] = defaultdict(int, counts)
+            analytics['total_downloads'] = data.get('total_downloads', 0)
+            analytics['active_today'] = set(data.get('active_today', []))
+            analytics['active_today_date'] = data.get('active_today_date', '')
+            if 'start_time_epoch' in data:
+                analytics['start_time'] = datetime.fromtimestamp(data['start_time_epoch'])
+            elif 'start_time' in data:
+                # Files written before start_time_epoch was introduced
+                analytics['start_time'] = datetime.fromisoformat(data['start_time'])
+            analytics['active_user_count'] = sum(1 for c in analytics['user_stats'].values() if c > 0)
+            analytics['private_total'] = sum(analytics['private_downloads'].values())
     except Exception as e:
         logger.error(f"Failed to load analytics: {e}")
 
-def save_analytics():
+# [date string, timestamp of the next local midnight when it goes stale]
+_today_cache = ['', 0.0]
+
+def today_str():
+    """Return today's local date as YYYY-MM-DD, recomputed only after midnight"""
+    now = time.time()
+    if now >= _today_cache[1]:
+        today = datetime.fromtimestamp(now)
+        next_midnight = today.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        _today_cache[:] = [today.strftime('%Y-%m-%d'), next_midnight.timestamp()]
+    return _today_cache[0]
+
+def active_users_today():
+    """Number of distinct users with a download today"""
+    if analytics['active_today_date'] != today_str():
+        return 0
+    return len(analytics['active_today'])
+
+def snapshot_analytics():
+    """Copy analytics so it can be serialized off the event loop"""
+    data = {k: dict(v) if isinstance(v, dict) else v for k, v in analytics.items() if k != 'start_time'}
+    data['active_today'] = list(analytics['active_today'])
+    data['start_time_epoch'] = analytics['start_time'].timestamp()
+    return data
+
+def save_analytics(data=None):
     try:
-        data = analytics.copy()
-        data['start_time'] = analytics['start_time'].isoformat()
-        with open('analytics.json', 'w') as f:
-            json.dump(data, f, default=str)
+        if data is None:
+            data = snapshot_analytics()
+        # user_stats is keyed by int user IDs, hence OPT_NON_STR_KEYS
+        write_file_atomic('analytics.json', orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
     except Exception as e:
         logger.error(f"Failed to save analytics: {e}")
 
 load_analytics()
+atexit.register(save_analytics)
+
+# === Sent Video Cache ===
+# URL -> (Telegram file_id, caption, kind) of videos already uploaded, oldest
+# first. kind is how Telegram stored the upload: video, animation or document.
+file_id_cache = OrderedDict()
+SENT_FILE_KINDS = ('video', 'animation', 'document')
+
+def load_file_id_cache():
+    try:
+        if os.path.exists(FILE_ID_CACHE_PATH):
+            with open(FILE_ID_CACHE_PATH, 'rb') as f:
+                for url, entry in orjson.loads(f.read()):
+                    # Entries saved before kinds were tracked are all videos
+                    file_id, caption, kind = entry if len(entry) == 3 else (*entry, 'video')
+                    file_id_cache[url] = (file_id, caption, kind)
+    except Exception as e:
+        logger.error(f"Failed to load file_id cache: {e}")
+
+def save_file_id_cache():
+    try:
+        write_file_atomic(FILE_ID_CACHE_PATH, orjson.dumps(list(file_id_cache.items())))
+    except Exception as e:
+        logger.error(f"Failed to save file_id cache: {e}")
+
+def remember_file_id(url, file_id, caption, kind):
+    file_id_cache[url] = (file_id, caption, kind)
+    file_id_cache.move_to_end(url)
+    if len(file_id_cache) > FILE_ID_CACHE_SIZE:
+        file_id_cache.popitem(last=False)
+
+def get_sent_file(message):
+    """Return (file_id, kind) of the file in a sent message, or None.
+
+    Telegram may store an uploaded MP4 as an animation (silent clips) or a
+    document rather than a video.
+    """
+    for kind in SENT_FILE_KINDS:
+        attachment = getattr(message, kind)
+        if attachment:
+            return attachment.file_id, kind
+    return None
+
+async def resend_file(message, file_id, caption, kind):
+    """Reply with an already uploaded file using the method matching its kind"""
+    if kind == 'animation':
+        await message.reply_animation(animation=file_id, caption=caption)
+    elif kind == 'document':
+        await message.reply_document(document=file_id, caption=caption)
+    else:
+        await message.reply_video(video=file_id, caption=caption)
+
+load_file_id_cache()
+atexit.register(save_file_id_cache)
+
+# === Cookie Availability Cache ===
+cookie_available = {}
+
+def refresh_cookies():
+    """Re-check which platform cookie files exist"""
+    for platform, path in COOKIE_PATHS.items():
+        cookie_available[platform] = os.path.exists(path)
+
+async def cookie_refresher():
+    """Periodically pick up cookie files added or removed while running"""
+    while True:
+        await asyncio.sleep(COOKIE_REFRESH_INTERVAL)
+        await asyncio.to_thread(refresh_cookies)
+
+refresh_cookies()
+
+# Set whenever analytics change; the flusher persists them in the background
+analytics_dirty = asyncio.Event()
+
+async def analytics_flusher(interval=5):
+    """Write analytics to disk at most once per interval while they are dirty"""
+    while True:
+        await analytics_dirty.wait()
+        await asyncio.sleep(interval)
+        analytics_dirty.clear()
+        await asyncio.to_thread(save_analytics, snapshot_analytics())
+
+async def analytics_gc():
+    """Once a day, drop daily download counts older than the retention window"""
+    while True:
+        cutoff = (datetime.now() - timedelta(days=DAILY_STATS_RETENTION_DAYS)).strftime('%Y-%m-%d')
+        stale = [day for day in analytics['daily_downloads'] if day < cutoff]
+        for day in stale:
+            del analytics['daily_downloads'][day]
+        if stale:
+            analytics_dirty.set()
+        await asyncio.sleep(24 * 60 * 60)
 
 # === Rate Limiting Storage ===
-user_requests = defaultdict(deque)
-download_queue = asyncio.Queue()
+download_queue = asyncio.Queue(maxsize=MAX_QUEUE_SIZE)
+cleanup_queue = asyncio.Queue()  # Downloaded files waiting to be deleted
+inflight = {}  # URL -> updates that sent the same link while it was queued or downloading
 active_downloads = 0
-download_lock = asyncio.Lock()
-user_progress = {}  # Track download progress per user
+download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
 
 class RateLimiter:
-    def __init__(self, max_requests=3, window_seconds=300):
+    def __init__(self, max_requests=3, window_seconds=300, max_users=50000):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.user_requests = defaultdict(deque)
+        self.max_users = max_users
+        # Sliding window counter per user: (prev_count, curr_count, window_slot),
+        # ordered least recently seen first so the cap can evict in O(1)
+        self.windows = OrderedDict()
+    
+    def _store(self, user_id, window):
+        self.windows[user_id] = window
+        self.windows.move_to_end(user_id)
+        if len(self.windows) > self.max_users:
+            self.windows.popitem(last=False)
+    
+    def _current(self, user_id, now):
+        """Return (prev, curr, slot, weighted_count) for the user's current window"""
+        slot = int(now // self.window_seconds)
+        prev, curr, start = self.windows.get(user_id, (0, 0, slot))
+        if start != slot:
+            # Rotate: the old current window becomes previous (or expires entirely)
+            prev, curr = (curr if start == slot - 1 else 0), 0
+        elapsed = now % self.window_seconds
+        weighted = prev * (1 - elapsed / self.window_seconds) + curr
+        return prev, curr, slot, weighted
     
     def is_allowed(self, user_id):
-        now = datetime.now()
-        user_queue = self.user_requests[user_id]
-        
-        # Remove old requests outside the time window
-        while user_queue and user_queue[0] < now - timedelta(seconds=self.window_seconds):
-            user_queue.popleft()
+        """Return (True, remaining requests) if allowed, else (False, seconds until the next one is)"""
+        now = time.monotonic()
+        prev, curr, slot, weighted = self._current(user_id, now)
         
         # Check if user has exceeded rate limit
-        if len(user_queue) >= self.max_requests:
-            return False, user_queue[0] + timedelta(seconds=self.window_seconds)
+        if weighted >= self.max_requests:
+            elapsed = now % self.window_seconds
+            if prev and curr < self.max_requests:
+                # Wait until enough of the previous window has slid out
+                wait = (1 - (self.max_requests - curr) / prev) * self.window_seconds - elapsed
+            else:
+                wait = self.window_seconds - elapsed
+            self._store(user_id, (prev, curr, slot))
+            return False, max(1.0, wait)
         
-        # Add current request timestamp
-        user_queue.append(now)
-        return True, None
+        # Count this request in the current window
+        self._store(user_id, (prev, curr + 1, slot))
+        return True, max(0, math.ceil(self.max_requests - weighted - 1))
     
     def get_remaining_requests(self, user_id):
-        now = datetime.now()
-        user_queue = self.user_requests[user_id]
-        
-        # Clean old requests
-        while user_queue and user_queue[0] < now - timedelta(seconds=self.window_seconds):
-            user_queue.popleft()
-        
-        return max(0, self.max_requests - len(user_queue))
+        weighted = self._current(user_id, time.monotonic())[3]
+        return max(0, math.ceil(self.max_requests - weighted))
+    
+    def evict_idle(self):
+        """Drop users whose previous and current windows have both expired"""
+        slot = int(time.monotonic() // self.window_seconds)
+        idle = [uid for uid, (_, _, start) in self.windows.items() if start < slot - 1]
+        for uid in idle:
+            del self.windows[uid]
+        return len(idle)
 
-rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW)
+rate_limiter = RateLimiter(RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, RATE_LIMIT_MAX_USERS)
+
+async def rate_limit_gc():
+    """Periodically evict idle users so rate limit state tracks only active users"""
+    while True:
+        await asyncio.sleep(RATE_LIMIT_WINDOW)
+        evicted = rate_limiter.evict_idle()
+        if evicted:
+            logger.debug(f"Evicted {evicted} idle rate limit entries")
 
+# Supported hosts (Instagram removed), matched against the URL's hostname suffix
+_PLATFORM_RE = re.compile(r'(?:^|\.)(tiktok\.com|twitter\.com|x\.com|facebook\.com|fb\.watch)$', re.I)
+_HOST_TO_PLATFORM = {
+    'tiktok.com': 'TikTok',
+    'twitter.com': 'Twitter/X',
+    'x.com': 'Twitter/X',
+    'facebook.com': 'Facebook',
+    'fb.watch': 'Facebook',
+}
+
+@lru_cache(maxsize=1024)
 def get_platform_from_url(url):
-    """Extract platform name from URL (Instagram removed)"""
-    if 'tiktok.com' in url:
-        return 'TikTok'
-    elif any(domain in url for domain in ['twitter.com', 'x.com']):
-        return 'Twitter/X'
-    elif 'facebook.com' in url or 'fb.watch' in url:
-        return 'Facebook'
-    return 'Unknown'
+    """Extract platform name from URL, or 'Unknown' if unsupported"""
+    try:
+        host = urlsplit(url if '//' in url else '//' + url).hostname or ''
+    except ValueError:
+        return 'Unknown'
+    m = _PLATFORM_RE.search(host)
+    return _HOST_TO_PLATFORM[m.group(1).lower()] if m else 'Unknown'
 
 # === TikTok Shortlink Resolver ===
 import aiohttp
@@ -157,7 +369,12 @@ async def resolve_tiktok_shortlink(url):
 
 def get_error_message(error_str):
     """Convert technical errors to user-friendly messages"""
-    error_lower = str(error_str).lower()
+    return _classify_error(str(error_str))
+
+@lru_cache(maxsize=512)
+def _classify_error(error_str):
+    # Plain substring checks on one lowercased copy beat a regex scan here
+    error_lower = error_str.lower()
     
     if 'private' in error_lower and 'cookies' not in error_lower:
         return "🔒 This appears to be a private video. The bot will attempt to download it using enhanced methods."
@@ -178,109 +395,317 @@ def get_error_message(error_str):
     elif 'cookie' in error_lower:
         return "🔒 Authentication issue. The bot will try alternative methods."
     else:
-        return f"❌ Download failed: {str(error_str)[:100]}..."
+        return f"❌ Download failed: {error_str[:100]}..."
+
+# === yt-dlp Option Templates ===
+# Built once at import; get_ydl_opts_for_platform hands out shallow copies, so
+# the nested dicts are shared and must be replaced rather than mutated.
+_DESKTOP_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+_BASE_YDL_OPTS = {
+    # job_id comes from blocking_download, so concurrent jobs for the same
+    # video never share a file
+    'outtmpl': '%(id)s_%(uploader)s_%(job_id)s.%(ext)s',
+    'noplaylist': True,
+    'extract_flat': False,
+    'no_warnings': False,
+    'ignoreerrors': False,
+    'retries': 5,
+    'fragment_retries': 5,
+    'skip_unavailable_fragments': True,
+    'socket_timeout': 30,
+}
+
+_PLATFORM_YDL_OPTS = {
+    'TikTok': {
+        **_BASE_YDL_OPTS,
+        'format': 'mp4/best[height<=1080]/best',
+        'extractor_args': {
+            'tiktok': {
+                'webpage_url_basename': 'share',
+                'api_hostname': 'api-h2.tiktokv.com'
+            }
+        },
+        'http_headers': {
+            'User-Agent': 'com.zhiliaoapp.musically/2022600030 (Linux; U; Android 7.1.2; es_ES; SM-G988N; Build/NRD90M;tt-ok/3.12.13.1)',
+            'Accept': '*/*',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Connection': 'keep-alive',
+            'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
+            'Sec-Fetch-Dest': 'empty',
+            'Sec-Fetch-Mode': 'cors',
+            'Sec-Fetch-Site': 'same-site',
+            'X-Requested-With': 'XMLHttpRequest',
+            'Referer': 'https://www.tiktok.com/',
+            'Origin': 'https://www.tiktok.com'
+        }
+    },
+    'Twitter/X': {
+        **_BASE_YDL_OPTS,
+        'format': 'mp4/best[height<=720]/best',
+        'http_headers': {
+            'User-Agent': _DESKTOP_USER_AGENT,
+        }
+    },
+    'Facebook': {
+        **_BASE_YDL_OPTS,
+        'format': 'mp4/best[height<=720]/best',
+        'http_headers': {
+            'User-Agent': _DESKTOP_USER_AGENT,
+        }
+    },
+}
 
 def get_ydl_opts_for_platform(platform, use_cookies=True):
     """Get yt-dlp options optimized for each platform (Instagram removed)"""
-    base_opts = {
-        'outtmpl': '%(id)s_%(uploader)s.%(ext)s',
-        'noplaylist': True,
-        'extract_flat': False,
-        'no_warnings': False,
-        'ignoreerrors': False,
-        'retries': 5,
-        'fragment_retries': 5,
-        'skip_unavailable_fragments': True,
-        'socket_timeout': 30,
-    }
-    if platform == 'TikTok':
-        base_opts.update({
-            'format': 'mp4/best[height<=1080]/best',
-            'extractor_args': {
-                'tiktok': {
-                    'webpage_url_basename': 'share',
-                    'api_hostname': 'api-h2.tiktokv.com'
-                }
-            },
-            'http_headers': {
-                'User-Agent': 'com.zhiliaoapp.musically/2022600030 (Linux; U; Android 7.1.2; es_ES; SM-G988N; Build/NRD90M;tt-ok/3.12.13.1)',
-                'Accept': '*/*',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8',
-                'Sec-Fetch-Dest': 'empty',
-                'Sec-Fetch-Mode': 'cors',
-                'Sec-Fetch-Site': 'same-site',
-                'X-Requested-With': 'XMLHttpRequest',
-                'Referer': 'https://www.tiktok.com/',
-                'Origin': 'https://www.tiktok.com'
-            }
-        })
-        if use_cookies and os.path.exists(TIKTOK_COOKIES):
-            base_opts['cookiefile'] = TIKTOK_COOKIES
-            logger.info("Using TikTok cookies for enhanced access")
-    elif platform == 'Twitter/X':
-        base_opts.update({
-            'format': 'mp4/best[height<=720]/best',
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            }
-        })
-    elif platform == 'Facebook':
-        base_opts.update({
-            'format': 'mp4/best[height<=720]/best',
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            }
-        })
-    return base_opts
+    opts = dict(_PLATFORM_YDL_OPTS.get(platform, _BASE_YDL_OPTS))
+    if use_cookies and cookie_available.get(platform):
+        opts['cookiefile'] = COOKIE_PATHS[platform]
+        logger.info(f"Using {platform} cookies for enhanced access")
+    return opts
+
+# === Video Limits for yt-dlp ===
+class VideoRejected(Exception):
+    """Raised by the match filter when a video exceeds the bot's limits"""
+
+def video_match_filter(info, *, incomplete=False):
+    """Reject over-long or oversized videos before any bytes are downloaded"""
+    duration = int(info.get('duration') or 0)
+    if duration > MAX_VIDEO_DURATION:
+        raise VideoRejected(
+            f"❌ Video too long ({duration//60}m {duration%60}s). "
+            f"Maximum allowed: {MAX_VIDEO_DURATION_MIN} minutes."
+        )
+    filesize = info.get('filesize') or info.get('filesize_approx') or 0
+    if filesize > MAX_FILE_SIZE:
+        raise VideoRejected(
+            f"❌ Video too large ({filesize / (1024 * 1024):.1f}MB). "
+            f"Maximum allowed: {MAX_FILE_SIZE_MB}MB."
+        )
+    return None
+
+def is_private_video(info):
+    """Heuristic check whether extracted video info belongs to a private video"""
+    return 'private' in str(info.get('description', '')).lower() or info.get('availability') == 'private'
+
+def describe_video(info):
+    """Build the video info card shown once metadata is known"""
+    title = (info.get('title') or 'Unknown')[:50]
+    uploader = info.get('uploader', 'Unknown')
+    duration = int(info.get('duration') or 0)
+    duration_str = f"{duration//60}m {duration%60}s" if duration else "Unknown"
+    privacy_indicator = "🔒 Private" if is_private_video(info) else "🌐 Public"
+    return (
+        f"📹 *{title}*\n"
+        f"👤 {uploader}\n"
+        f"⏱️ {duration_str}\n"
+        f"🔐 {privacy_indicator}\n"
+        f"🎬 Starting download..."
+    )
+
+# === Progress Message Updates ===
+class ProgressUpdater:
+    """Coalesce progress edits to a message, sending at most one per interval"""
+    
+    def __init__(self, message, loop, interval=1.0):
+        self.message = message
+        self.loop = loop
+        self.interval = interval
+        self.latest = None
+        self.sent = None
+        self.closed = False
+        self.event = asyncio.Event()
+        self.task = loop.create_task(self._run())
+    
+    def update(self, text):
+        """Record the newest text; safe to call from yt-dlp threads"""
+        self.latest = text
+        self.loop.call_soon_threadsafe(self.event.set)
+    
+    async def _edit_latest(self):
+        text = self.latest
+        if text is None or text == self.sent:
+            return
+        try:
+            await self.message.edit_text(text)
+            self.sent = text
+        except Exception as e:
+            logger.debug(f"Progress edit failed: {e}")
+    
+    async def _run(self):
+        while True:
+            await self.event.wait()
+            await asyncio.sleep(self.interval)
+            self.event.clear()
+            await self._edit_latest()
+    
+    async def close(self):
+        """Stop coalescing and send any pending text immediately"""
+        if self.closed:
+            return
+        self.closed = True
+        self.task.cancel()
+        await self._edit_latest()
 
 # === Progress Hook for yt-dlp ===
-def create_progress_hook(user_id, update, loop):
-    """Create a progress hook for yt-dlp downloads"""
+def create_progress_hook(updater):
+    """Create a progress hook for yt-dlp downloads.
+
+    Throttle state lives in the closure, so the per-chunk path does no shared
+    dict lookups; text only goes out through the job's ProgressUpdater.
+    """
+    last_percent = 0
+    announced = False
     
     def progress_hook(d):
+        nonlocal last_percent, announced
         try:
             if d['status'] == 'downloading':
-                if user_id in user_progress:
-                    percent = d.get('_percent_str', 'N/A').strip()
+                # Show the video info card on the first progress callback
+                if not announced:
+                    announced = True
+                    updater.update(describe_video(d.get('info_dict') or {}))
+                
+                # Integer percent straight from the byte counters yt-dlp reports
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                # total_bytes_estimate is a float for fragmented (HLS/DASH) downloads
+                current_percent = int(d.get('downloaded_bytes', 0) * 100 // total) if total else 0
+                
+                # Update progress every 10% to avoid spam
+                if current_percent - last_percent >= 10 or (current_percent >= 99 and last_percent < 99):
+                    last_percent = current_percent
+                    progress_text = f"⏬ Downloading... {current_percent}%"
                     speed = d.get('_speed_str', 'N/A').strip()
+                    if speed != 'N/A':
+                        progress_text += f" at {speed}"
                     
-                    # Update progress every 10% to avoid spam
-                    current_percent = float(percent.replace('%', '')) if percent != 'N/A' else 0
-                    last_percent = user_progress[user_id].get('last_percent', 0)
+                    # Coalesced into at most one edit per second
+                    updater.update(progress_text)
                     
-                    if current_percent - last_percent >= 10 or current_percent >= 99:
-                        user_progress[user_id]['last_percent'] = current_percent
-                        progress_text = f"⏬ Downloading... {percent}"
-                        if speed != 'N/A':
-                            progress_text += f" at {speed}"
-                        
-                        # Schedule the update in the event loop
-                        try:
-                            asyncio.run_coroutine_threadsafe(
-                                user_progress[user_id]['message'].edit_text(progress_text),
-                                loop
-                            )
-                        except:
-                            pass  # Ignore edit errors
-                            
             elif d['status'] == 'finished':
-                if user_id in user_progress:
-                    try:
-                        asyncio.run_coroutine_threadsafe(
-                            user_progress[user_id]['message'].edit_text("📤 Upload in progress..."),
-                            loop
-                        )
-                    except:
-                        pass
-                        
+                updater.update("📤 Upload in progress...")
+                    
         except Exception as e:
             logger.error(f"Progress hook error: {e}")
     
     return progress_hook
 
+# === Downloaded File Helpers ===
+# Blocking yt-dlp and file I/O, run in threads to keep the event loop free.
+# yt-dlp gets its own pool so downloads can't starve other to_thread work.
+ytdl_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix='ytdl')
+
+# Each ytdl thread keeps one YoutubeDL per option set, so extractor setup is
+# paid once per thread rather than per download. The per-download progress
+# hook is routed through a thread-local since the instance outlives the job.
+_ydl_local = threading.local()
+# Guards cookie file state shared by the ytdl threads
+_cookie_lock = threading.Lock()
+# Cookie path -> [generation, mtime]; the generation only moves on outside
+# edits, so write-backs by one thread don't make the others rebuild
+_cookie_state = {}
+
+def _dispatch_progress(d):
+    hook = getattr(_ydl_local, 'progress_hook', None)
+    if hook:
+        hook(d)
+
+def _cookie_mtime(path):
+    """Return a cookie file's mtime, or None if there is no such file"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+def _cookie_generation(path):
+    """Return the cookie file's generation, bumping it if edited externally. Hold _cookie_lock."""
+    mtime = _cookie_mtime(path)
+    state = _cookie_state.get(path)
+    if state is None:
+        state = _cookie_state[path] = [0, mtime]
+    elif state[1] != mtime:
+        state[0] += 1
+        state[1] = mtime
+    return state[0]
+
+def get_thread_ydl(opts_key, ydl_opts):
+    """Return this thread's YoutubeDL entry [ydl, cookie_generation] for an option set.
+
+    The instance is rebuilt when its cookie file is changed from outside, so
+    cookies replaced while the bot is running are picked up without a restart.
+    """
+    instances = getattr(_ydl_local, 'instances', None)
+    if instances is None:
+        instances = _ydl_local.instances = {}
+    with _cookie_lock:
+        generation = _cookie_generation(ydl_opts.get('cookiefile'))
+    entry = instances.get(opts_key)
+    if entry is not None and entry[1] != generation:
+        # Don't let close() write the stale jar over the new cookie file
+        entry[0].params.pop('cookiefile', None)
+        entry[0].close()
+        entry = None
+    if entry is None:
+        ydl = yt_dlp.YoutubeDL({**ydl_opts, 'progress_hooks': [_dispatch_progress]})
+        entry = instances[opts_key] = [ydl, generation]
+    return entry
+
+def save_thread_cookies(entry, cookiefile):
+    """Write back cookies yt-dlp refreshed during a download"""
+    ydl, generation = entry
+    with _cookie_lock:
+        # Skip if the file was replaced meanwhile; the next job reloads it
+        if _cookie_generation(cookiefile) != generation:
+            return
+        ydl.save_cookies()
+        _cookie_state[cookiefile][1] = _cookie_mtime(cookiefile)
+
+def blocking_download(opts_key, ydl_opts, progress_hook, url):
+    """Extract and download a video with yt-dlp, returning (info, file_path)"""
+    job_id = uuid.uuid4().hex[:8]
+    entry = get_thread_ydl(opts_key, ydl_opts)
+    ydl = entry[0]
+    _ydl_local.progress_hook = progress_hook
+    try:
+        info = ydl.extract_info(url, download=True, extra_info={'job_id': job_id})
+        return info, ydl.prepare_filename(info)
+    finally:
+        _ydl_local.progress_hook = None
+        cookiefile = ydl_opts.get('cookiefile')
+        if cookiefile:
+            try:
+                save_thread_cookies(entry, cookiefile)
+            except Exception as e:
+                logger.warning(f"Failed to save cookies to {cookiefile}: {e}")
+
+def read_video_file(file_path):
+    """Read a downloaded video, or return None if yt-dlp produced no file"""
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def remove_video_file(file_path):
+    """Delete a downloaded video if it exists"""
+    try:
+        os.remove(file_path)
+        logger.debug(f"Cleaned up file: {file_path}")
+    except FileNotFoundError:
+        pass
+
+async def file_janitor():
+    """Delete sent files in the background so download slots free up immediately"""
+    while True:
+        file_path = await cleanup_queue.get()
+        try:
+            await asyncio.to_thread(remove_video_file, file_path)
+        except Exception as e:
+            logger.error(f"Failed to clean up {file_path}: {e}")
+        finally:
+            cleanup_queue.task_done()
+
 # === Download Queue Worker ===
 async def download_worker():
     """Background worker that processes download queue"""
@@ -289,41 +714,88 @@ async def download_worker():
     logger.info("Download worker started")
     
     while True:
+        task = await download_queue.get()
         try:
-            task = await download_queue.get()
-            
-            async with download_lock:
-                while active_downloads >= MAX_CONCURRENT_DOWNLOADS:
-                    await asyncio.sleep(1)
+            # Wakes as soon as a download slot frees up
+            async with download_semaphore:
                 active_downloads += 1
-            
-            await process_download_task(task)
-            download_queue.task_done()
-            
-            async with download_lock:
-                active_downloads -= 1
-                
+                result = None
+                try:
+                    result = await process_download_task(task)
+                finally:
+                    active_downloads -= 1
+                    await deliver_to_duplicates(task[1], result)
         except Exception as e:
             logger.error(f"Download worker error: {e}")
-            async with download_lock:
-                active_downloads = max(0, active_downloads - 1)
+        finally:
+            download_queue.task_done()
+
+def record_download(user_id, platform):
+    """Count a successfully delivered video in analytics"""
+    today = today_str()
+    analytics['total_downloads'] += 1
+    analytics['daily_downloads'][today] += 1
+    if analytics['active_today_date'] != today:
+        analytics['active_today'] = set()
+        analytics['active_today_date'] = today
+    analytics['active_today'].add(user_id)
+    analytics['platform_stats'][platform] += 1
+    if not analytics['user_stats'].get(user_id):
+        analytics['active_user_count'] += 1
+    analytics['user_stats'][user_id] += 1
+    analytics_dirty.set()
+
+async def deliver_to_duplicates(url, result):
+    """Send a finished download to users who sent the same link while it was in flight"""
+    platform = get_platform_from_url(url)
+    for update in inflight.pop(url, []):
+        try:
+            if isinstance(result, str):
+                # The video was rejected; pass on the same reason
+                await update.message.reply_text(result)
+            elif result:
+                # Reuse Telegram's copy of the uploaded video; nothing is re-uploaded
+                await resend_file(update.message, *result)
+                record_download(update.effective_user.id, platform)
+            else:
+                await update.message.reply_text("❌ The download for this link failed. Please try again later.")
+        except Exception as e:
+            logger.error(f"Failed to deliver duplicate request to user {update.effective_user.id}: {e}")
 
 async def process_download_task(task):
-    """Process individual download task with enhanced private video support"""
+    """Process individual download task with enhanced private video support.
+
+    Returns (file_id, caption, kind) of the sent video on success, the rejection
+    message if the video was turned away by the match filter, otherwise None.
+    """
     update, url = task
     user_id = update.effective_user.id
     username = update.effective_user.username or "unknown"
     platform = get_platform_from_url(url)
     
     logger.info(f"Processing {platform} download for user {user_id} (@{username}): {url}")
+    loop = asyncio.get_running_loop()
     
+    # Re-send a video Telegram already has without downloading it again
+    cached = file_id_cache.get(url)
+    if cached:
+        try:
+            await resend_file(update.message, *cached)
+            file_id_cache.move_to_end(url)
+            record_download(user_id, platform)
+            logger.info(f"Sent cached {platform} video to user {user_id}")
+            return cached
+        except Exception as e:
+            logger.warning(f"Cached file_id for {url} failed, downloading again: {e}")
+            file_id_cache.pop(url, None)
+    
+    # Progress state is local to this job; the hook reaches it by closure
+    progress_msg = None
+    updater = None
     try:
         # Send initial progress message
         progress_msg = await update.message.reply_text("🎬 Preparing download...")
-        user_progress[user_id] = {
-            'message': progress_msg,
-            'last_percent': 0
-        }
+        updater = ProgressUpdater(progress_msg, loop)
 
         # Heuristic: try fallback (minimal headers) first for TikTok, then mobile, web, api
         if platform == 'TikTok':
@@ -344,110 +816,90 @@ async def process_download_task(task):
         for attempt_num, (method, status_msg) in enumerate(download_attempts):
             try:
                 if attempt_num > 0:
-                    await progress_msg.edit_text(status_msg)
+                    updater.update(status_msg)
                     await asyncio.sleep(2)  # Brief delay between attempts
                 # Get platform-specific options with method variation
                 ydl_opts = get_ydl_opts_for_platform_with_method(platform, method, attempt_num > 0)
-                ydl_opts['progress_hooks'] = [create_progress_hook(user_id, update, asyncio.get_event_loop())]
-                # Extract video info first
-                with yt_dlp.YoutubeDL({**ydl_opts, 'quiet': True}) as ydl:
-                    try:
-                        info = ydl.extract_info(url, download=False)
-                        # Check if video appears to be private
-                        if info and ('private' in str(info.get('description', '')).lower() or 
-                                   info.get('availability') == 'private'):
-                            is_private = True
-                            analytics['private_downloads'][platform] += 1
-                        # Check video duration
-                        duration = info.get('duration', 0)
-                        if duration and duration > MAX_VIDEO_DURATION:
-                            await progress_msg.edit_text(
-                                f"❌ Video too long ({duration//60}m {duration%60}s). "
-                                f"Maximum allowed: {MAX_VIDEO_DURATION//60} minutes."
-                            )
-                            return
-                        # Check file size estimate
-                        filesize = info.get('filesize') or info.get('filesize_approx', 0)
-                        if filesize and filesize > MAX_FILE_SIZE:
-                            size_mb = filesize / (1024 * 1024)
-                            await progress_msg.edit_text(
-                                f"❌ Video too large ({size_mb:.1f}MB). "
-                                f"Maximum allowed: {MAX_FILE_SIZE//1024//1024}MB."
-                            )
-                            return
-                        # Show video info
-                        title = info.get('title', 'Unknown')[:50]
-                        uploader = info.get('uploader', 'Unknown')
-                        duration_str = f"{duration//60}m {duration%60}s" if duration else "Unknown"
-                        privacy_indicator = "🔒 Private" if is_private else "🌐 Public"
-                        await progress_msg.edit_text(
-                            f"📹 *{title}*\n"
-                            f"👤 {uploader}\n"
-                            f"⏱️ {duration_str}\n"
-                            f"🔐 {privacy_indicator}\n"
-                            f"🎬 Starting download..."
-                        )
-                    except Exception as e:
-                        logger.warning(f"Failed to extract info for {url} (attempt {attempt_num + 1}, method {method}): {e}")
-                        if attempt_num == len(download_attempts) - 1:
-                            raise e
-                        continue
-                # Download the video
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                    file_path = ydl.prepare_filename(info)
+                ydl_opts['match_filter'] = video_match_filter
+                ydl_opts['max_filesize'] = MAX_FILE_SIZE
+                opts_key = (platform, method, ydl_opts.get('cookiefile'))
+                # Extract and download in a single pass on the yt-dlp thread pool
+                info, file_path = await loop.run_in_executor(
+                    ytdl_executor, blocking_download, opts_key, ydl_opts, create_progress_hook(updater), url
+                )
+                if is_private_video(info):
+                    is_private = True
+                    analytics['private_downloads'][platform] += 1
+                    analytics['private_total'] += 1
                 # If we reach here, download was successful
                 logger.info(f"Successfully downloaded {platform} video using method: {method}")
                 break
+            except VideoRejected as e:
+                await updater.close()
+                await progress_msg.edit_text(str(e))
+                return str(e)
             except Exception as e:
                 logger.error(f"Download attempt {attempt_num + 1} (method: {method}) failed: {e}")
                 if attempt_num == len(download_attempts) - 1:
                     # Last attempt failed
                     raise e
                 continue
+        # Flush any pending progress text before editing the message directly
+        await updater.close()
         # Send the video
         try:
-            if file_path and os.path.exists(file_path):
-                file_size = os.path.getsize(file_path)
-                with open(file_path, 'rb') as video_file:
-                    privacy_tag = "🔒 Private" if is_private else "🌐 Public"
-                    caption = (
-                        f"✅ Downloaded from {platform}\n"
-                        f"👤 {info.get('uploader', 'Unknown')}\n"
-                        f"📁 {file_size/(1024*1024):.1f}MB\n"
-                        f"🔐 {privacy_tag}"
-                    )
-                    await update.message.reply_video(
-                        video=video_file,
-                        caption=caption
-                    )
-                # Update analytics
-                analytics['total_downloads'] += 1
-                analytics['daily_downloads'][datetime.now().strftime('%Y-%m-%d')] += 1
-                analytics['platform_stats'][platform] += 1
-                analytics['user_stats'][user_id] += 1
-                save_analytics()
+            video_data = await asyncio.to_thread(read_video_file, file_path) if file_path else None
+            if video_data is not None:
+                file_size = len(video_data)
+                privacy_tag = "🔒 Private" if is_private else "🌐 Public"
+                caption = (
+                    f"✅ Downloaded from {platform}\n"
+                    f"👤 {info.get('uploader', 'Unknown')}\n"
+                    f"📁 {file_size/(1024*1024):.1f}MB\n"
+                    f"🔐 {privacy_tag}"
+                )
+                sent = await update.message.reply_video(
+                    video=video_data,
+                    filename=os.path.basename(file_path),
+                    caption=caption,
+                    supports_streaming=True,
+                    read_timeout=UPLOAD_TIMEOUT,
+                    write_timeout=UPLOAD_TIMEOUT
+                )
+                record_download(user_id, platform)
                 logger.info(f"Successfully sent {platform} video to user {user_id} (Private: {is_private})")
+                sent_file = get_sent_file(sent)
+                if sent_file:
+                    file_id, kind = sent_file
+                    remember_file_id(url, file_id, caption, kind)
+                    return file_id, caption, kind
+            else:
+                # yt-dlp skips files that turn out larger than max_filesize mid-download
+                await progress_msg.edit_text(
+                    f"❌ Video could not be downloaded. It may exceed the "
+                    f"{MAX_FILE_SIZE_MB}MB limit."
+                )
         except Exception as e:
             error_msg = get_error_message(str(e))
             await progress_msg.edit_text(f"⚠️ Failed to send video: {error_msg}")
             logger.error(f"Failed to send video to user {user_id}: {e}")
         finally:
             # Cleanup
-            if file_path and os.path.exists(file_path):
-                os.remove(file_path)
-                logger.debug(f"Cleaned up file: {file_path}")
-            if user_id in user_progress:
-                del user_progress[user_id]
+            if file_path:
+                cleanup_queue.put_nowait(file_path)
     except Exception as e:
         error_msg = get_error_message(str(e))
-        await user_progress.get(user_id, {}).get('message', update.message).reply_text(error_msg)
+        if updater:
+            await updater.close()
+        await (progress_msg or update.message).reply_text(error_msg)
         # Update error analytics
         analytics['error_stats'][platform] += 1
-        save_analytics()
+        analytics_dirty.set()
         logger.error(f"Download failed for user {user_id} ({platform}): {e}")
-        if user_id in user_progress:
-            del user_progress[user_id]
+    finally:
+        # Runs on every exit path, even if the error reply itself fails
+        if updater:
+            await updater.close()
 
 def get_ydl_opts_for_platform_with_method(platform, method, use_cookies=True):
     """Get yt-dlp options with specific extraction methods for TikTok"""
@@ -456,7 +908,10 @@ def get_ydl_opts_for_platform_with_method(platform, method, use_cookies=True):
     if platform == 'TikTok':
         if method == "mobile":
             # Mobile app extraction
-            base_opts['http_headers']['User-Agent'] = 'com.zhiliaoapp.musically/2022600030 (Linux; U; Android 7.1.2; es_ES; SM-G988N; Build/NRD90M;tt-ok/3.12.13.1)'
+            base_opts['http_headers'] = {
+                **base_opts['http_headers'],
+                'User-Agent': 'com.zhiliaoapp.musically/2022600030 (Linux; U; Android 7.1.2; es_ES; SM-G988N; Build/NRD90M;tt-ok/3.12.13.1)'
+            }
             base_opts['extractor_args'] = {
                 'tiktok': {
                     'api_hostname': 'api-h2.tiktokv.com'
@@ -464,7 +919,7 @@ def get_ydl_opts_for_platform_with_method(platform, method, use_cookies=True):
             }
         elif method == "web":
             # Web browser extraction
-            base_opts['http_headers']['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+            base_opts['http_headers'] = {**base_opts['http_headers'], 'User-Agent': _DESKTOP_USER_AGENT}
             base_opts['extractor_args'] = {
                 'tiktok': {
                     'api_hostname': 'www.tiktok.com'
@@ -472,7 +927,10 @@ def get_ydl_opts_for_platform_with_method(platform, method, use_cookies=True):
             }
         elif method == "api":
             # Direct API extraction
-            base_opts['http_headers']['User-Agent'] = 'TikTok 26.2.0 rv:262018 (iPhone; iOS 14.4.2; en_US) Cronet'
+            base_opts['http_headers'] = {
+                **base_opts['http_headers'],
+                'User-Agent': 'TikTok 26.2.0 rv:262018 (iPhone; iOS 14.4.2; en_US) Cronet'
+            }
             base_opts['extractor_args'] = {
                 'tiktok': {
                     'api_hostname': 'api2-25-h2.musical.ly'
@@ -503,6 +961,54 @@ async def set_commands(application):
     await application.bot.set_my_commands(commands)
     logger.info("Bot commands set successfully")
 
+# === Static Message Text ===
+# Built once from the configuration instead of on every command
+START_TEXT = (
+    f"🎬 *Supported Platforms:*\n"
+    f"• TikTok\n"
+    f"• Twitter/X\n"
+    f"• Facebook\n\n"
+    f"📊 *Rate Limits:*\n"
+    f"• {RATE_LIMIT_REQUESTS} downloads per {RATE_LIMIT_WINDOW_MIN} minutes\n"
+    f"• Max {MAX_CONCURRENT_DOWNLOADS} concurrent downloads\n"
+    f"• Max file size: {MAX_FILE_SIZE_MB}MB\n"
+    f"• Max duration: {MAX_VIDEO_DURATION_MIN} minutes\n\n"
+    f"📤 Just send me a video link to get started!"
+)
+
+HELP_TEXT = (
+    "📌 *How to use this bot:*\n\n"
+    "1️⃣ Send me a video link from supported platforms\n"
+    "2️⃣ Wait for the download to complete\n"
+    "3️⃣ Receive your video!\n\n"
+    "🎬 *Supported Platforms:*\n"
+    "• TikTok (tiktok.com)\n"
+    "• Twitter/X (twitter.com, x.com)\n"
+    "• Facebook (facebook.com, fb.watch)\n\n"
+    "📊 *Commands:*\n"
+    "• /status - Check your rate limit status\n"
+    "• /queue - Check download queue status\n"
+    "• /stats - View your download statistics\n\n"
+    f"⚡ *Limits:* {RATE_LIMIT_REQUESTS} downloads per {RATE_LIMIT_WINDOW_MIN} minutes\n"
+    f"📁 *Max file size:* {MAX_FILE_SIZE_MB}MB\n"
+    f"⏱️ *Max duration:* {MAX_VIDEO_DURATION_MIN} minutes\n\n"
+    "_Note: Both public and private videos are supported._"
+)
+
+UNSUPPORTED_TEXT = (
+    "❌ Unsupported platform!\n\n"
+    "🎬 *Supported platforms:*\n"
+    "• TikTok (tiktok.com)\n"
+    "• Twitter/X (twitter.com, x.com)\n"
+    "• Facebook (facebook.com, fb.watch)\n\n"
+    "Use /help for more information."
+)
+
+ADMIN_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Detailed Stats", callback_data="admin_detailed")],
+    [InlineKeyboardButton("🔄 Restart Queue", callback_data="admin_restart")]
+])
+
 # === Command Handlers ===
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_name = update.effective_user.first_name or "there"
@@ -512,43 +1018,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"User {user_id} (@{username}) started the bot")
     
     await update.message.reply_text(
-        f"👋 Welcome {user_name}!\n\n"
-        f"🎬 *Supported Platforms:*\n"
-        f"• TikTok\n"
-        f"• Twitter/X\n"
-        f"• Facebook\n\n"
-        f"📊 *Rate Limits:*\n"
-        f"• {RATE_LIMIT_REQUESTS} downloads per {RATE_LIMIT_WINDOW//60} minutes\n"
-        f"• Max {MAX_CONCURRENT_DOWNLOADS} concurrent downloads\n"
-        f"• Max file size: {MAX_FILE_SIZE//1024//1024}MB\n"
-        f"• Max duration: {MAX_VIDEO_DURATION//60} minutes\n\n"
-        f"📤 Just send me a video link to get started!",
+        f"👋 Welcome {user_name}!\n\n{START_TEXT}",
         parse_mode="Markdown"
     )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = (
-        "📌 *How to use this bot:*\n\n"
-        "1️⃣ Send me a video link from supported platforms\n"
-        "2️⃣ Wait for the download to complete\n"
-        "3️⃣ Receive your video!\n\n"
-        "🎬 *Supported Platforms:*\n"
-        "• TikTok (tiktok.com)\n"
-        "• Twitter/X (twitter.com, x.com)\n"
-        "• Facebook (facebook.com, fb.watch)\n\n"
-        "📊 *Commands:*\n"
-        "• /status - Check your rate limit status\n"
-        "• /queue - Check download queue status\n"
-        "• /stats - View your download statistics\n\n"
-        f"⚡ *Limits:* {RATE_LIMIT_REQUESTS} downloads per {RATE_LIMIT_WINDOW//60} minutes\n"
-        f"📁 *Max file size:* {MAX_FILE_SIZE//1024//1024}MB\n"
-        f"⏱️ *Max duration:* {MAX_VIDEO_DURATION//60} minutes\n\n"
-        "_Note: Both public and private videos are supported._"
-    )
-    await update.message.reply_text(help_text, parse_mode="Markdown")
+    await update.message.reply_text(HELP_TEXT, parse_mode="Markdown")
 
 async def cookies_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    tiktok_status = "✅ Available" if os.path.exists(TIKTOK_COOKIES) else "❌ Not configured"
+    tiktok_status = "✅ Available" if cookie_available['TikTok'] else "❌ Not configured"
     cookies_text = (
         f"🔒 *Private Video Access*\n\n"
         f"This bot uses enhanced methods to download private TikTok videos:\n\n"
@@ -576,11 +1054,11 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     status_text = (
         f"📊 *Your Status:*\n\n"
         f"• Remaining downloads: {remaining}/{RATE_LIMIT_REQUESTS}\n"
-        f"• Rate limit window: {RATE_LIMIT_WINDOW//60} minutes\n"
+        f"• Rate limit window: {RATE_LIMIT_WINDOW_MIN} minutes\n"
         f"• Queue position: {download_queue.qsize()} pending\n"
         f"• Active downloads: {active_downloads}/{MAX_CONCURRENT_DOWNLOADS}\n"
-        f"• Your total downloads: {analytics['user_stats'][user_id]}\n"
-        f"• Private videos downloaded: {sum(analytics['private_downloads'].values())}"
+        f"• Your total downloads: {analytics['user_stats'].get(user_id, 0)}\n"
+        f"• Private videos downloaded: {analytics['private_total']}"
     )
     await update.message.reply_text(status_text, parse_mode="Markdown")
 
@@ -598,7 +1076,7 @@ async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_downloads = analytics['user_stats'][user_id]
+    user_downloads = analytics['user_stats'].get(user_id, 0)
     
     # Top platforms for this user (simplified)
     remaining = rate_limiter.get_remaining_requests(user_id)
@@ -607,16 +1085,27 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📈 *Your Statistics:*\n\n"
         f"• Total downloads: {user_downloads}\n"
         f"• Remaining today: {remaining}/{RATE_LIMIT_REQUESTS}\n"
-        f"• Private videos accessed: {sum(analytics['private_downloads'].values())}\n\n"
+        f"• Private videos accessed: {analytics['private_total']}\n\n"
         f"🏆 *Global Stats:*\n"
         f"• Total bot downloads: {analytics['total_downloads']}\n"
-        f"• Downloads today: {analytics['daily_downloads'][datetime.now().strftime('%Y-%m-%d')]}\n"
-        f"• Active users today: {len([u for u, c in analytics['user_stats'].items() if c > 0])}\n"
+        f"• Downloads today: {analytics['daily_downloads'].get(today_str(), 0)}\n"
+        f"• Active users today: {active_users_today()}\n"
         f"• Private video success rate: ~75%"
     )
     
     await update.message.reply_text(stats_text, parse_mode="Markdown")
 
+# [timestamp, usage] of the last statvfs, refreshed at most every DISK_USAGE_TTL seconds
+DISK_USAGE_TTL = 30
+_disk_usage_cache = [0.0, None]
+
+async def get_disk_usage():
+    """Return cached shutil.disk_usage('.'), refreshing it off the event loop"""
+    now = time.monotonic()
+    if _disk_usage_cache[1] is None or now - _disk_usage_cache[0] > DISK_USAGE_TTL:
+        _disk_usage_cache[:] = [now, await asyncio.to_thread(shutil.disk_usage, '.')]
+    return _disk_usage_cache[1]
+
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
@@ -627,11 +1116,11 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Admin {user_id} accessed admin panel")
     
     # System stats
-    disk_usage = shutil.disk_usage('.')
+    disk_usage = await get_disk_usage()
     uptime = datetime.now() - analytics['start_time']
     
     # Top platforms
-    top_platforms = sorted(analytics['platform_stats'].items(), key=lambda x: x[1], reverse=True)[:5]
+    top_platforms = heapq.nlargest(5, analytics['platform_stats'].items(), key=itemgetter(1))
     platform_text = "\n".join([f"• {platform}: {count}" for platform, count in top_platforms])
     
     # Private video stats
@@ -645,7 +1134,7 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📊 *System Status:*\n"
         f"• Uptime: {str(uptime).split('.')[0]}\n"
         f"• Total downloads: {analytics['total_downloads']}\n"
-        f"• Active users: {len(analytics['user_stats'])}\n"
+        f"• Active users: {analytics['active_user_count']}\n"
         f"• Queue size: {download_queue.qsize()}\n"
         f"• Active downloads: {active_downloads}/{MAX_CONCURRENT_DOWNLOADS}\n\n"
         f"🔒 *Private Video Stats:*\n{private_text or 'None yet'}\n\n"
@@ -655,13 +1144,7 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"❌ *Recent Errors:*\n{error_text or 'None'}"
     )
     
-    keyboard = [
-        [InlineKeyboardButton("📊 Detailed Stats", callback_data="admin_detailed")],
-        [InlineKeyboardButton("🔄 Restart Queue", callback_data="admin_restart")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(admin_text, parse_mode="Markdown", reply_markup=reply_markup)
+    await update.message.reply_text(admin_text, parse_mode="Markdown", reply_markup=ADMIN_MARKUP)
 
 # === Callback Query Handler ===
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -670,7 +1153,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if query.data == "admin_detailed" and query.from_user.id in ADMIN_IDS:
         # Show detailed admin stats
-        daily_stats = sorted(analytics['daily_downloads'].items())[-7:]  # Last 7 days
+        # Last 7 days; ISO date keys order correctly as strings
+        daily_stats = heapq.nlargest(7, analytics['daily_downloads'].items())[::-1]
         daily_text = "\n".join([f"• {date}: {count}" for date, count in daily_stats])
         
         detailed_text = (
@@ -681,7 +1165,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"• Average downloads per user: {analytics['total_downloads'] / max(len(analytics['user_stats']), 1):.1f}\n\n"
             f"🔒 *Privacy Features:*\n"
             # Instagram cookies removed
-            f"• TikTok cookies: {'✅' if os.path.exists(TIKTOK_COOKIES) else '❌'}\n"
+            f"• TikTok cookies: {'✅' if cookie_available['TikTok'] else '❌'}\n"
             f"• Private video success rate: ~75%"
         )
         
@@ -694,17 +1178,29 @@ async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     url = update.message.text.strip()
     logger.info(f"Received URL from user {user_id} (@{username}): {url}")
 
+    platform = get_platform_from_url(url)
+
     # TikTok shortlink resolution
-    if "tiktok.com" in url:
+    if platform == 'TikTok':
         orig_url = url
         url = await resolve_tiktok_shortlink(url)
         if url != orig_url:
             logger.info(f"Resolved TikTok shortlink: {orig_url} -> {url}")
 
+    # Check supported platforms (Instagram removed)
+    if platform == 'Unknown':
+        await update.message.reply_text(UNSUPPORTED_TEXT)
+        return
+
+    # Turn the link away if the queue is full, before it counts against the rate limit
+    if url not in inflight and download_queue.full():
+        await update.message.reply_text("⏳ Server busy, please try again in a minute.")
+        return
+
     # Check rate limiting
-    allowed, reset_time = rate_limiter.is_allowed(user_id)
+    allowed, limit_info = rate_limiter.is_allowed(user_id)
     if not allowed:
-        time_left = int((reset_time - datetime.now()).total_seconds())
+        time_left = math.ceil(limit_info)
         await update.message.reply_text(
             f"⏰ Rate limit exceeded!\n"
             f"Try again in {time_left//60}m {time_left%60}s\n"
@@ -712,28 +1208,20 @@ async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Check supported platforms (Instagram removed)
-    supported_domains = [
-        'tiktok.com', 'twitter.com', 'x.com',
-        'facebook.com', 'fb.watch'
-    ]
-    if not any(domain in url for domain in supported_domains):
+    # Piggy-back on an identical link that is already queued or downloading
+    if url in inflight:
+        inflight[url].append(update)
         await update.message.reply_text(
-            "❌ Unsupported platform!\n\n"
-            "🎬 *Supported platforms:*\n"
-            "• TikTok (tiktok.com)\n"
-            "• Twitter/X (twitter.com, x.com)\n"
-            "• Facebook (facebook.com, fb.watch)\n\n"
-            "Use /help for more information."
+            "⏳ This video is already being downloaded.\n"
+            "You'll receive it as soon as it's ready!"
         )
         return
 
-    # Add to download queue
-    await download_queue.put((update, url))
+    # Add to download queue; room was checked above with no await in between
+    download_queue.put_nowait((update, url))
+    inflight[url] = []
     queue_position = download_queue.qsize()
-    platform = get_platform_from_url(url)
-
-    remaining = rate_limiter.get_remaining_requests(user_id)
+    remaining = limit_info
 
     await update.message.reply_text(
         f"✅ Added {platform} video to queue!\n"
@@ -747,14 +1235,22 @@ async def post_init(application):
     await set_commands(application)
     # Create cookies directory if it doesn't exist
     os.makedirs('cookies', exist_ok=True)
-    # Start the download worker
-    asyncio.create_task(download_worker())
+    refresh_cookies()
+    # Start one download worker per slot and background maintenance tasks
+    for _ in range(MAX_CONCURRENT_DOWNLOADS):
+        asyncio.create_task(download_worker())
+    asyncio.create_task(analytics_flusher())
+    asyncio.create_task(analytics_gc())
+    asyncio.create_task(cookie_refresher())
+    asyncio.create_task(rate_limit_gc())
+    asyncio.create_task(file_janitor())
     logger.info("Bot initialization completed")
     # Instagram cookies removed
-    logger.info(f"TikTok cookies: {'✅' if os.path.exists(TIKTOK_COOKIES) else '❌'}")
+    logger.info(f"TikTok cookies: {'✅' if cookie_available['TikTok'] else '❌'}")
 
-# Create application with simple approach - no custom timeouts for now
-app = ApplicationBuilder().token(TOKEN).build()
+# Create application with simple approach - no custom timeouts for now.
+# post_init runs inside run_polling's event loop, before polling starts.
+app = ApplicationBuilder().token(TOKEN).post_init(post_init).build()
 
 # === Register Handlers ===
 app.add_handler(CommandHandler("start", start))
@@ -769,19 +1265,12 @@ app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_link))
 # === Run the bot ===
 if __name__ == "__main__":
     logger.info("🤖 Enhanced Bot starting...")
-    logger.info(f"📊 Rate limits: {RATE_LIMIT_REQUESTS} requests per {RATE_LIMIT_WINDOW//60} minutes")
+    logger.info(f"📊 Rate limits: {RATE_LIMIT_REQUESTS} requests per {RATE_LIMIT_WINDOW_MIN} minutes")
     logger.info(f"⚡ Max concurrent downloads: {MAX_CONCURRENT_DOWNLOADS}")
     logger.info(f"👑 Admin users: {len(ADMIN_IDS)}")
     logger.info("❌ YouTube support: Disabled")
     
     try:
-        # Initialize bot components
-        async def startup():
-            await post_init(app)
-        
-        # Run startup in the background
-        asyncio.get_event_loop().run_until_complete(startup())
-        
         # Start the bot
         app.run_polling(drop_pending_updates=True)
         